@@ -1,12 +1,18 @@
-"""Abstract base class and helpers for firmware building classes"""
+"""Base class and helpers for firmware building classes"""
+import errno
+import functools
+import hashlib
 import logging
+import os
 import textwrap
-from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Literal, Optional, Union
 from urllib.parse import urljoin
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
 from openwrt_composer.exceptions import (
     ContextDirectoryCreationFailure,
@@ -16,50 +22,240 @@ from openwrt_composer.exceptions import (
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 logger.addHandler(logging.NullHandler())
 
+# Context directories known to exist, so that repeated preparation of the same
+# context skips creating them.
+_PREPARED_DIRS: set[Path] = set()
+
+
+def _as_bytes(contents: Union[str, bytes]) -> bytes:
+    """Return `contents` as UTF-8 encoded bytes"""
+
+    return contents if isinstance(contents, bytes) else contents.encode("utf-8")
+
+
+def _as_str(contents: Union[str, bytes]) -> str:
+    """Return `contents` as a string, decoding UTF-8 encoded bytes"""
+
+    return contents.decode("utf-8") if isinstance(contents, bytes) else contents
+
 
 def _prepare_context_dir(
-    context_dir: Path, containerfile: str, files: Optional[Dict[str, str]]
+    context_dir: Path,
+    containerfile: Union[str, bytes],
+    files: Optional[Dict[str, Union[str, bytes]]],
 ) -> None:
     """Prepare a context directory for a container image build
 
     Args:
         context_dir: The Path of the context directory to create and prepare.
-        containerfile: The contents of the Containerfile to create.
+        containerfile: The contents of the Containerfile to create, either as a
+            string or as UTF-8 encoded bytes.
         files: A dictionary of files to create in the context directory. The
-            dictionary keys are the filenames, and the values are the contents.
+            dictionary keys are the filenames, and the values are the contents,
+            either as strings or as UTF-8 encoded bytes.
 
     Raises:
-        RuntimeError: Raised if the `context_dir` exists but is not a directory.
-        OSError: Raised if creating the `context_dir` fails.
+        ContextDirectoryCreationFailure: Raised if the `context_dir` exists but is
+            not a directory, or if creating the `context_dir` fails.
 
     """
-    if context_dir.exists():
-        if not context_dir.is_dir():
-            msg = "Context exists but is not a directory: {context_dir}"
-            logger.error(msg)
-            raise ContextDirectoryCreationFailure(msg)
-    else:
+    if context_dir not in _PREPARED_DIRS:
+        # With exist_ok, mkdir only raises FileExistsError if the path exists but
+        # isn't a directory. Each directory is only prepared once per process.
         try:
-            logger.info(f"Creating context directory: {context_dir}")
+            logger.info("Preparing context directory: %s", context_dir)
             context_dir.mkdir(parents=True, exist_ok=True)
+        except FileExistsError:
+            msg = f"Context exists but is not a directory: {context_dir}"
+            logger.error(msg)
+            raise ContextDirectoryCreationFailure(msg)
         except OSError:
             msg = f"Failed to create directory: {context_dir}"
             logger.exception(msg)
             raise ContextDirectoryCreationFailure(msg)
+        _PREPARED_DIRS.add(context_dir)
 
-    logger.info(f"Creating {context_dir}/Containerfile")
-    with open(context_dir / "Containerfile", "w") as fp:
+    logger.info("Creating %s/Containerfile", context_dir)
+    if logger.isEnabledFor(logging.DEBUG):
         logger.debug("Containerfile contents:")
-        logger.debug(containerfile)
-        fp.write(containerfile)
+        logger.debug(_as_str(containerfile))
+    (context_dir / "Containerfile").write_bytes(_as_bytes(containerfile))
 
     if files is not None:
         for file, contents in files.items():
-            logger.info(f"Creating {context_dir/file}")
-            with open(context_dir / file, "w") as fp:
+            logger.info("Creating %s/%s", context_dir, file)
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug("Contents:")
-                logger.debug(contents)
-                fp.write(contents)
+                logger.debug(_as_str(contents))
+            (context_dir / file).write_bytes(_as_bytes(contents))
+
+
+_DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+_REQUEST_TIMEOUT: tuple[int, int] = (5, 60)
+
+
+def _create_session() -> requests.Session:
+    """Create a HTTP session with connection pooling and retries
+
+    Returns:
+        A `requests.Session` which keeps connections alive between requests, and
+        retries requests which fail due to transient mirror errors.
+
+    """
+    retries = urllib3.Retry(
+        total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retries)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_SESSION: requests.Session = _create_session()
+
+# Number of concurrent range requests used to download an archive when the server
+# supports range requests.
+_DOWNLOAD_RANGES: int = 4
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+    """Write all of `data` to a file descriptor at a given offset
+
+    Args:
+        fd: The file descriptor to write to.
+        data: The data to write.
+        offset: The offset in the file to write `data` at.
+
+    """
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """Reserve disk space for a file before writing it
+
+    Reserving the space up front lets the filesystem allocate contiguous blocks
+    in one go, rather than extending the file with every write. Filesystems which
+    don't support preallocation are skipped silently.
+
+    Args:
+        fd: The file descriptor of the file.
+        size: The size of the file in bytes.
+
+    """
+    if size <= 0:
+        return
+
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as exc:
+        if exc.errno not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+            raise
+
+
+def _download_stream(url: str, path: Path, size: int) -> str:
+    """Download a URL to a file over a single connection
+
+    The SHA256 digest of the file is computed as it is downloaded.
+
+    Args:
+        url: The URL to download.
+        path: The path of the file to write to.
+        size: The expected size of the resource in bytes, or 0 if unknown.
+
+    Returns:
+        The SHA256 hex digest of the downloaded file.
+
+    """
+    digest = hashlib.sha256()
+
+    with _SESSION.get(url, stream=True, timeout=_REQUEST_TIMEOUT) as res:
+        res.raise_for_status()
+        res.raw.decode_content = True
+        with open(path, "wb", buffering=_DOWNLOAD_CHUNK_SIZE) as fp:
+            _preallocate(fp.fileno(), size)
+            while chunk := res.raw.read(_DOWNLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                fp.write(chunk)
+            # Drop any preallocated space beyond what was actually received.
+            fp.truncate()
+
+    return digest.hexdigest()
+
+
+def _download_range(url: str, fd: int, start: int, end: int) -> None:
+    """Download a byte range of a URL into the same range of a file
+
+    Args:
+        url: The URL to download from.
+        fd: The file descriptor of the file to write to.
+        start: The offset of the first byte of the range.
+        end: The offset of the last byte of the range.
+
+    Raises:
+        ImageBuilderRetrievalFailure: Raised if the server doesn't return exactly
+            the requested range.
+
+    """
+    headers = {"Range": f"bytes={start}-{end}"}
+    with _SESSION.get(
+        url, headers=headers, stream=True, timeout=_REQUEST_TIMEOUT
+    ) as res:
+        res.raise_for_status()
+        if res.status_code != requests.codes.partial_content:
+            raise ImageBuilderRetrievalFailure(
+                f"Range request for {url} returned status {res.status_code}"
+            )
+
+        offset = start
+        for chunk in res.iter_content(_DOWNLOAD_CHUNK_SIZE):
+            _pwrite_all(fd, chunk, offset)
+            offset += len(chunk)
+
+    if offset != end + 1:
+        raise ImageBuilderRetrievalFailure(
+            f"Incomplete range {start}-{end} retrieved from {url}"
+        )
+
+
+def _download_ranges(url: str, path: Path, size: int) -> str:
+    """Download a URL to a file using concurrent range requests
+
+    As the ranges arrive out of order, the SHA256 digest of the file is computed
+    once all of them have been written.
+
+    Args:
+        url: The URL to download. The server must support range requests.
+        path: The path of the file to write to.
+        size: The size of the resource in bytes.
+
+    Returns:
+        The SHA256 hex digest of the downloaded file.
+
+    """
+    range_size = -(-size // _DOWNLOAD_RANGES)
+
+    with open(path, "w+b") as fp:
+        fd = fp.fileno()
+        _preallocate(fd, size)
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=_DOWNLOAD_RANGES) as executor:
+            futures = [
+                executor.submit(
+                    _download_range, url, fd, start, min(start + range_size, size) - 1
+                )
+                for start in range(0, size, range_size)
+            ]
+            for future in futures:
+                future.result()
+
+        fp.seek(0)
+        return hashlib.file_digest(fp, "sha256").hexdigest()
 
 
 _ENTRYPOINT_SCRIPT: str = textwrap.dedent(
@@ -69,12 +265,16 @@ _ENTRYPOINT_SCRIPT: str = textwrap.dedent(
     exec "$@"
     """
 )
+_ENTRYPOINT_SCRIPT_BYTES: bytes = _ENTRYPOINT_SCRIPT.encode("utf-8")
 _ENTRYPOINT_SCRIPT_NAME: str = "entrypoint.sh"
 
-_BASE_CONTAINERFILE: str = textwrap.dedent(
+_CONTAINERFILE_SYNTAX: str = "# syntax=docker/dockerfile:1.4\n"
+
+_BASE_STAGE: str = textwrap.dedent(
     f"""\
-    FROM fedora:39
-    RUN dnf -y install \
+    FROM fedora:39 AS base
+    RUN --mount=type=cache,target=/var/cache/dnf,sharing=locked \
+      dnf -y --setopt=keepcache=1 install \
       @c-development \
       @development-tools \
       @development-libs \
@@ -84,9 +284,10 @@ _BASE_CONTAINERFILE: str = textwrap.dedent(
       python2 \
       wget \
       xz \
+      zstd \
       rsync \
       perl-FindBin \
-      time && dnf clean all
+      time
     COPY {_ENTRYPOINT_SCRIPT_NAME} /{_ENTRYPOINT_SCRIPT_NAME}
     RUN chmod 755 /{_ENTRYPOINT_SCRIPT_NAME}
     ENTRYPOINT ["/{_ENTRYPOINT_SCRIPT_NAME}"]
@@ -94,30 +295,86 @@ _BASE_CONTAINERFILE: str = textwrap.dedent(
     """
 )
 
-_BASE_IMAGE_TAG: str = "openwrt-composer-base"
+_BASE_CONTAINERFILE: str = _CONTAINERFILE_SYNTAX + _BASE_STAGE
 
-_BUILDER_CONTAINERFILE: str = textwrap.dedent(
-    """\
-    FROM openwrt-composer-base
-    COPY {entrypoint_script_name} /{entrypoint_script_name}
-    RUN chmod 755 /{entrypoint_script_name}
-    RUN groupadd openwrt && useradd -g openwrt openwrt
-    RUN mkdir /openwrt && chown openwrt:openwrt /openwrt
-    WORKDIR /openwrt
-    COPY --chown=openwrt:openwrt {archive_file} .
-    USER openwrt
-    RUN tar -xf {archive_file}
-    WORKDIR /openwrt/{archive_dir}
-    ENTRYPOINT ["/{entrypoint_script_name}"]
-    CMD ["/bin/bash"]
-    """  # noqa: E501
+_BASE_CONTAINERFILE_BYTES: bytes = _BASE_CONTAINERFILE.encode("utf-8")
+
+# The base image tag includes a digest of the base Containerfile, so that a
+# change to the base image definition results in the base image being rebuilt.
+_BASE_IMAGE_TAG: str = (
+    "openwrt-composer-base:"
+    f"{hashlib.sha256(_BASE_CONTAINERFILE_BYTES).hexdigest()[:12]}"
 )
 
+ArchiveCompression = Literal["xz", "zst", "gz"]
+
+# Commands used to unpack the image builder archive for each compression type.
+# zstd is used with -T0 so that decompression is multi-threaded.
+_EXTRACT_COMMANDS: Dict[str, str] = {
+    "xz": "tar -xf",
+    "zst": "tar --use-compress-program='zstd -T0' -xf",
+    "gz": "tar -xf",
+}
+
+# The builder image is built with a multi-stage build whose first stage is the
+# base image, so that a single image build produces the builder image. Building
+# the base image on its own beforehand only serves to warm the layer cache.
+_BUILDER_CONTAINERFILE: str = (
+    _CONTAINERFILE_SYNTAX
+    + _BASE_STAGE
+    + textwrap.dedent(
+        """\
+        FROM base AS builder
+        RUN groupadd openwrt && useradd -g openwrt openwrt
+        RUN mkdir /openwrt && chown openwrt:openwrt /openwrt
+        WORKDIR /openwrt
+        COPY --chown=openwrt:openwrt {archive_file} .
+        USER openwrt
+        RUN {extract_command} {archive_file}
+        WORKDIR /openwrt/{archive_dir}
+        ENTRYPOINT ["/{entrypoint_script_name}"]
+        CMD ["/bin/bash"]
+        """  # noqa: E501
+    )
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _render_builder_containerfile(
+    archive_file: str, archive_dir: str, compression: ArchiveCompression
+) -> str:
+    """Render the builder Containerfile for a builder archive
+
+    Args:
+        archive_file: The file name of the builder archive.
+        archive_dir: The directory the builder archive unpacks to.
+        compression: The compression of the builder archive.
+
+    Returns:
+        The contents of the builder Containerfile.
+
+    """
+    return _BUILDER_CONTAINERFILE.format(
+        archive_file=archive_file,
+        archive_dir=archive_dir,
+        extract_command=_EXTRACT_COMMANDS[compression],
+        entrypoint_script_name=_ENTRYPOINT_SCRIPT_NAME,
+    )
 
-class Builder(ABC):
-    """An abstract base class for a firmware builder class
 
-    The concrete class should call the constructor of this base class via `super()`.
+@functools.lru_cache(maxsize=256)
+def _render_builder_image_tag(version: str, target: str, sub_target: str) -> str:
+    """Render the tag of the builder image for a version, target and sub-target"""
+    return f"openwrt-composer-{version}-{target}-{sub_target}"
+
+
+class Builder:
+    """A base class for a firmware builder class
+
+    The concrete class should call the constructor of this base class via `super()`,
+    and implement the methods which raise `NotImplementedError`. Builders use
+    `__slots__`, so a concrete class adding attributes should declare them in its
+    own `__slots__`.
 
     Args:
         version: The OpenWRT release this builder will use when building a firmware
@@ -127,10 +384,36 @@ class Builder(ABC):
         profile: The device profile for this firmware builder.
         work_dir: The directory that will be used by this builder for storing files.
         openwrt_base_url: The base URL for OpenWRT firmware builder archives.
+        compression: The compression of the builder archive to retrieve. If not
+            specified, a zstd compressed archive is used if the release provides
+            one, and an xz compressed archive otherwise.
 
     """
 
-    @abstractmethod
+    # Whether an image needs building, keyed by image tag. This is shared between
+    # all builders, as the base image is common to all of them.
+    _image_build_needed_cache: Dict[str, bool] = {}
+
+    __slots__ = (
+        "version",
+        "target",
+        "sub_target",
+        "profile",
+        "work_dir",
+        "compression",
+        "openwrt_base_url",
+        "_builder_image_tag",
+        "_base_image_tag",
+        "_release_target_url",
+        "_archive_dir",
+        "_archive_file",
+        "_archive_url",
+        "_base_context_dir",
+        "_builder_context_dir",
+        "_base_containerfile",
+        "_builder_containerfile",
+    )
+
     def __init__(
         self,
         version: str,
@@ -139,45 +422,78 @@ class Builder(ABC):
         profile: str,
         work_dir: Path,
         openwrt_base_url: str,
+        compression: Optional[ArchiveCompression] = None,
     ) -> None:
         self.version = version
         self.target = target
         self.sub_target = sub_target
         self.profile = profile
         self.work_dir = work_dir
+        self.compression = compression
 
-        self._builder_image_tag = (
-            f"openwrt-composer-{version}-{target}-{sub_target}"  # noqa: E501
-        )
+        self._builder_image_tag = _render_builder_image_tag(version, target, sub_target)
         self._base_image_tag = _BASE_IMAGE_TAG
 
-        if not openwrt_base_url.endswith("/"):
-            self.openwrt_base_url: str = openwrt_base_url + "/"
-        else:
-            self.openwrt_base_url: str = openwrt_base_url
+        self.openwrt_base_url = openwrt_base_url.rstrip("/") + "/"
+        self._release_target_url = urljoin(
+            self.openwrt_base_url, f"releases/{version}/targets/{target}/{sub_target}/"
+        )
 
         self._archive_dir = (
             f"openwrt-imagebuilder-{version}-{target}-{sub_target}.Linux-x86_64"
         )
-        self._archive_file = f"{self._archive_dir}.tar.xz"
         self._base_context_dir = self.work_dir / "base"
         self._builder_context_dir = (
             self.work_dir / self.version / self.target / self.sub_target
         )
-        self._base_containerfile = _BASE_CONTAINERFILE
-        self._builder_containerfile = _BUILDER_CONTAINERFILE.format(
-            archive_file=self._archive_file,
-            archive_dir=self._archive_dir,
-            entrypoint_script_name=_ENTRYPOINT_SCRIPT_NAME,
+        self._base_containerfile = _BASE_CONTAINERFILE_BYTES
+        self._set_archive_compression(compression or "xz")
+
+    def _set_archive_compression(self, compression: ArchiveCompression) -> None:
+        """Set the builder archive file and Containerfile for a compression type
+
+        Args:
+            compression: The compression of the builder archive.
+
+        """
+
+        self._archive_file = f"{self._archive_dir}.tar.{compression}"
+        self._archive_url = self._release_target_url + self._archive_file
+        self._builder_containerfile = _render_builder_containerfile(
+            self._archive_file, self._archive_dir, compression
         )
 
+    def _select_archive_compression(self) -> None:
+        """Select the compression of the builder archive to retrieve
+
+        If a compression was specified when creating the builder it is used as is.
+        Otherwise the release is probed for a zstd compressed archive, which is much
+        faster to unpack than the xz compressed one, falling back to xz if there
+        isn't one.
+
+        """
+
+        if self.compression is not None:
+            return
+
+        url = f"{self._release_target_url}{self._archive_dir}.tar.zst"
+        try:
+            res = _SESSION.head(url, allow_redirects=True, timeout=_REQUEST_TIMEOUT)
+        except requests.RequestException:
+            logger.warning("Failed to probe for %s, falling back to xz", url)
+            zst_available = False
+        else:
+            zst_available = res.ok
+
+        self._set_archive_compression("zst" if zst_available else "xz")
+
     def _prepare_base_context(self) -> None:
         """Prepare a context directory for building the base image"""
 
         _prepare_context_dir(
             context_dir=self._base_context_dir,
             containerfile=self._base_containerfile,
-            files={_ENTRYPOINT_SCRIPT_NAME: _ENTRYPOINT_SCRIPT},
+            files={_ENTRYPOINT_SCRIPT_NAME: _ENTRYPOINT_SCRIPT_BYTES},
         )
 
     def _prepare_builder_context(self) -> None:
@@ -186,15 +502,88 @@ class Builder(ABC):
         _prepare_context_dir(
             context_dir=self._builder_context_dir,
             containerfile=self._builder_containerfile,
-            files={_ENTRYPOINT_SCRIPT_NAME: _ENTRYPOINT_SCRIPT},
+            files={_ENTRYPOINT_SCRIPT_NAME: _ENTRYPOINT_SCRIPT_BYTES},
+        )
+
+    def _cached_image_build_needed(
+        self, tag: str, build_needed: Callable[[], bool]
+    ) -> bool:
+        """Determine if an image needs building, remembering the result
+
+        Args:
+            tag: The tag of the image.
+            build_needed: Called to determine if the image needs building if the
+                result isn't already known.
+
+        Returns:
+            ``True`` if the image needs building, ``False`` otherwise.
+
+        """
+
+        try:
+            return self._image_build_needed_cache[tag]
+        except KeyError:
+            needed = self._image_build_needed_cache[tag] = build_needed()
+            return needed
+
+    def _cached_base_image_build_needed(self) -> bool:
+        """Determine if the base image needs building, remembering the result"""
+
+        return self._cached_image_build_needed(
+            self._base_image_tag, self._base_image_build_needed
+        )
+
+    def _cached_builder_image_build_needed(self) -> bool:
+        """Determine if the builder image needs building, remembering the result"""
+
+        return self._cached_image_build_needed(
+            self._builder_image_tag, self._builder_image_build_needed
         )
 
+    def _build_base_image(self) -> None:
+        """Prepare the base context and build the base image from it"""
+
+        self._prepare_base_context()
+        self._create_base_image()
+        self._image_build_needed_cache[self._base_image_tag] = False
+
+    def _prepare_builder_archive(self) -> None:
+        """Prepare the builder context and retrieve the builder archive into it"""
+
+        self._select_archive_compression()
+        self._prepare_builder_context()
+        self._retrieve_builder_archive()
+
+    def _archive_sha256(self) -> Optional[str]:
+        """Look up the published SHA256 checksum of the builder archive
+
+        Returns:
+            The SHA256 hex digest from the `sha256sums` file published alongside
+            the builder archive, or ``None`` if no checksum is published for it.
+
+        """
+
+        res = _SESSION.get(
+            self._release_target_url + "sha256sums", timeout=_REQUEST_TIMEOUT
+        )
+        if res.status_code == requests.codes.not_found:
+            return None
+        res.raise_for_status()
+
+        for line in res.text.splitlines():
+            checksum, _, file_name = line.partition(" ")
+            if file_name.lstrip(" *") == self._archive_file:
+                return checksum
+
+        return None
+
     def _retrieve_builder_archive(self) -> None:
         """Retrieve OpenWRT image builder archive
 
         The file is stored in the context directory suitable for building the firmware
         builder image. If the builder archive is already present in the builder context,
-        then the retrieval is skipped.
+        then the retrieval is skipped. The archive is verified against the checksum
+        published alongside it, if there is one.
 
         Raises:
             ImageBuilderRetrievalFailure: Raised if retrieving the builder archive
@@ -206,24 +595,49 @@ class Builder(ABC):
         if builder_archive.exists():
             return
 
-        url = urljoin(
-            self.openwrt_base_url,
-            f"releases/{self.version}/targets/{self.target}/{self.sub_target}/{self._archive_file}",  # noqa: E501
-        )
-        res = requests.get(url)
-
-        if res.ok:
-            with open(builder_archive, "wb") as fp:
-                for block in res.iter_content(1024):
-                    if block:
-                        fp.write(block)
-                        fp.flush()
-        else:
+        # Download to a temporary file which is only moved into place once the
+        # download has completed, so that an interrupted download is never
+        # mistaken for a complete archive on a subsequent run.
+        partial_archive = builder_archive.with_name(builder_archive.name + ".part")
+
+        url = self._archive_url
+        try:
+            res = _SESSION.head(url, allow_redirects=True, timeout=_REQUEST_TIMEOUT)
+            res.raise_for_status()
+            size = int(res.headers.get("Content-Length", 0))
+
+            # Use concurrent range requests if the server supports them and the
+            # archive is large enough for it to be worthwhile, which makes better
+            # use of mirrors that throttle each connection.
+            if (
+                res.headers.get("Accept-Ranges") == "bytes"
+                and size >= _DOWNLOAD_RANGES * _DOWNLOAD_CHUNK_SIZE
+            ):
+                digest = _download_ranges(res.url, partial_archive, size)
+            else:
+                digest = _download_stream(res.url, partial_archive, size)
+
+            expected_digest = self._archive_sha256()
+            if expected_digest is None:
+                logger.warning("No published checksum found for %s", url)
+            elif digest != expected_digest:
+                raise ImageBuilderRetrievalFailure(
+                    f"Checksum mismatch for {url}: expected {expected_digest}, "
+                    f"got {digest}"
+                )
+
+            os.replace(partial_archive, builder_archive)
+        except (
+            OSError,
+            requests.RequestException,
+            urllib3.exceptions.HTTPError,
+            ImageBuilderRetrievalFailure,
+        ) as exc:
+            partial_archive.unlink(missing_ok=True)
             msg = f"Failed to retrieve {url}"
-            logger.error(msg)
-            raise ImageBuilderRetrievalFailure(msg)
+            logger.exception(msg)
+            raise ImageBuilderRetrievalFailure(msg) from exc
 
-    @abstractmethod
     def _create_base_image(self) -> None:
         """Create the base container image
 
@@ -231,30 +645,27 @@ class Builder(ABC):
 
         """
 
-        pass
+        raise NotImplementedError
 
-    @abstractmethod
-    def _base_image_build_needed(self) -> None:
+    def _base_image_build_needed(self) -> bool:
         """Determine if the base image needs building"""
 
-        pass
+        raise NotImplementedError
 
-    @abstractmethod
-    def _builder_image_build_needed(self) -> None:
-        """Determine if the base image needs building"""
+    def _builder_image_build_needed(self) -> bool:
+        """Determine if the builder image needs building"""
 
-        pass
+        raise NotImplementedError
 
-    @abstractmethod
     def _create_builder_image(self) -> None:
         """Create the firmware builder image
 
         Firmware builder images are specific to each version, target, and sub_target.
 
         """
-        pass
 
-    @abstractmethod
+        raise NotImplementedError
+
     def _build_firmware(
         self, build_cmd: List[str], output_dir: Path, files_dir: Optional[Path]
     ) -> None:
@@ -266,7 +677,56 @@ class Builder(ABC):
             files_dir: Path to directory containing files to include in the firmware.
         """
 
-        pass
+        raise NotImplementedError
+
+    def prepare_base_image(self) -> None:
+        """Build the base image if it is not already available
+
+        The base image is the first stage of all firmware builder image builds, so
+        this can be called once to warm the layer cache before building several
+        firmware images concurrently.
+
+        """
+
+        if self._cached_base_image_build_needed():
+            logger.info("Building base image")
+            self._build_base_image()
+        else:
+            logger.info("Base image found.")
+
+    def prepare_builder_image(self) -> None:
+        """Build the firmware builder image if it is not already available
+
+        Firmware builds which share a version, target and sub-target share a
+        builder image, so this can be called once per builder image before
+        building those firmware images concurrently.
+
+        """
+
+        if self._cached_builder_image_build_needed():
+            logger.info("Building builder image: %s.", self._builder_image_tag)
+
+            # The builder image build doesn't depend on the base image, but
+            # building the base image warms the layer cache for the first stage of
+            # the builder image build. That doesn't depend on the builder archive
+            # download, so run the two concurrently. Only the builder image build
+            # needs to wait for both.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(self._prepare_builder_archive)]
+
+                if self._cached_base_image_build_needed():
+                    logger.info("Building base image")
+                    futures.append(executor.submit(self._build_base_image))
+                else:
+                    logger.info("Base image found.")
+
+                for future in futures:
+                    future.result()
+
+            self._create_builder_image()
+            self._image_build_needed_cache[self._builder_image_tag] = False
+        else:
+            logger.info("Builder image found.")
 
     def build_firmware(
         self,
@@ -286,25 +746,15 @@ class Builder(ABC):
 
         """
 
-        if self._base_image_build_needed():
-            logger.info("Building base image")
-            self._prepare_base_context()
-            self._create_base_image()
-        else:
-            logger.info("Base image found.")
-
-        if self._builder_image_build_needed():
-            logger.info(f"Building builder image: {self._builder_image_tag}.")
-            self._prepare_builder_context()
-            self._retrieve_builder_archive()
-            self._create_builder_image()
-        else:
-            logger.info("Builder image found.")
+        self.prepare_builder_image()
 
-        firmware = (
-            f"openwrt-{self.version}-{self.target}-{self.sub_target}-{self.profile}"
+        logger.info(
+            "Building firmware: openwrt-%s-%s-%s-%s",
+            self.version,
+            self.target,
+            self.sub_target,
+            self.profile,
         )
-        logger.info(f"Building firmware: {firmware}")
 
         build_cmd = [
             "make",
@@ -1,7 +1,12 @@
+import atexit
+import hashlib
 import logging
+import os
+import shutil
 import sys
 import tempfile
 import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from typing import Optional
 
@@ -10,9 +15,10 @@ from rich.logging import RichHandler
 from rich.table import Table
 from typer import Option, Typer
 
-from openwrt_composer.exceptions import ConfigCreationError, FirmwareBuildFailure
+from openwrt_composer.exceptions import BaseImageBuildFailure, ConfigCreationError
 from openwrt_composer.podman import PodmanBuilder
-from openwrt_composer.schemas import Config, Firmware
+from openwrt_composer.schemas import Config, Firmware, FirmwareSpecification
+from openwrt_composer.utils import load_toml_file
 
 LOG_LEVELS = {
     "none": logging.CRITICAL + 1,
@@ -26,10 +32,75 @@ LOG_LEVELS = {
 
 LOG_FORMAT = "%(message)s"
 
+# Memory backed file system used to stage files for inclusion in firmware.
+TMPFS_DIR = "/dev/shm"
+
 app = Typer()
 console = Console()
 
 
+def _create_builder(
+    firmware_specification: FirmwareSpecification,
+    work_dir: Path,
+    openwrt_base_url: str,
+    podman_uri: str,
+) -> PodmanBuilder:
+    """Create a firmware builder for a firmware specification."""
+    return PodmanBuilder(
+        version=firmware_specification.version,
+        target=firmware_specification.target,
+        sub_target=firmware_specification.sub_target,
+        profile=firmware_specification.profile,
+        work_dir=work_dir,
+        openwrt_base_url=openwrt_base_url,
+        podman_uri=podman_uri,
+    )
+
+
+def _prepare_builder_image(
+    firmware_specification: FirmwareSpecification,
+    work_dir: Path,
+    openwrt_base_url: str,
+    podman_uri: str,
+) -> None:
+    """Build the builder image for a firmware specification if needed.
+
+    This is run in a worker process, once for each builder image.
+
+    """
+    with _create_builder(
+        firmware_specification, work_dir, openwrt_base_url, podman_uri
+    ) as builder:
+        builder.prepare_builder_image()
+
+
+def _build_firmware(
+    firmware_specification: FirmwareSpecification,
+    work_dir: Path,
+    files_dir: Path,
+    output_dir: Path,
+    openwrt_base_url: str,
+    podman_uri: str,
+) -> None:
+    """Build a single firmware image.
+
+    This is run in a worker process, so all arguments are plain picklable values
+    and each worker creates its own builder and Podman connection.
+
+    """
+    if firmware_specification.packages is not None:
+        packages = firmware_specification.packages.as_string()
+    else:
+        packages = None
+
+    with _create_builder(
+        firmware_specification, work_dir, openwrt_base_url, podman_uri
+    ) as builder:
+        builder.build_firmware(
+            output_dir, packages, files_dir, firmware_specification.extra_name
+        )
+
+
 @app.command()
 def build(
     manifest: Path,
@@ -45,6 +116,16 @@ def build(
         "-l",
         help="Specify log level. This is used for debugging, and defaults to 'none' to prevent logs from being emitted.",
     ),
+    jobs: Optional[int] = Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        help=(
+            "Maximum number of firmware images to build concurrently. Defaults to "
+            "the max_parallel configuration setting, or the number of CPUs less two."
+        ),
+    ),
 ) -> None:
     # Setup logging
     logging.basicConfig(
@@ -59,117 +140,216 @@ def build(
     # Read configuration from a file if specified on the command line,
     # otherwise set from the environment and defaults.
     if configuration is not None:
-        with open(configuration, "rb") as fp:
-            config_dict = tomllib.load(fp)
-        config = Config.parse_obj(config_dict["openwrt_composer"])
+        config_dict = load_toml_file(configuration)
+        config = Config.model_validate(config_dict["openwrt_composer"])
     else:
         config = Config()
 
-    with open(manifest, "rb") as fp:
-        spec = tomllib.load(fp)
+    manifest_bytes = manifest.read_bytes()
+    spec = tomllib.loads(manifest_bytes.decode("utf-8"))
 
-    firmware_specification = Firmware.parse_obj(spec).firmware
+    firmware_specifications = Firmware.model_validate(spec).firmware
+
+    if config.container_engine == "podman":
+        if config.podman is None:
+            console.print(
+                "podman container engine specified but podman configuration not found. Exiting."
+            )
+            sys.exit(-1)
+    else:
+        console.print(
+            "No supported container engine specified in configuration. Exiting."
+        )
+        sys.exit(-1)
 
-    table = Table(show_header=False)
-    table.add_row("Target", f"{firmware_specification.target}")
-    table.add_row("Sub-target", f"{firmware_specification.sub_target}")
-    table.add_row("Profile", f"{firmware_specification.profile}")
-    table.add_row("Extra name", f"{firmware_specification.extra_name or '<None>'}")
-    table.add_row("OpenWRT version", f"{firmware_specification.version}")
+    openwrt_base_url = str(config.openwrt_base_url)
+    podman_uri = str(config.podman.uri)
 
-    work_dir = config.work_dir or Path.cwd() / "openwrt-composer"
-    table.add_row("Working directory", f"{work_dir}")
+    # Make the work directory absolute once, so that all paths derived from it
+    # are absolute too.
+    work_dir = (config.work_dir or Path.cwd() / "openwrt-composer").absolute()
 
     try:
         work_dir.mkdir(parents=True, exist_ok=True)
     except OSError:
-        console.print(
-            f"Failed to create work directory: {work_dir.absolute()}. Exiting."
-        )
+        console.print(f"Failed to create work directory: {work_dir}. Exiting.")
         console.print_exception(show_locals=True)
         sys.exit(-1)
 
-    # Create build directory for firmware creation. Also create
-    # subdirectories for storing the files for inclusion in the
-    # firmware, and for the produced firmware.
+    # Create build directory for firmware creation. Each firmware gets its own
+    # subdirectory of the build directory, which in turn has subdirectories for
+    # storing the files for inclusion in the firmware, and for the produced
+    # firmware. The build directory is named after a digest of the manifest, so
+    # that rebuilding an unchanged manifest reuses the same directories and
+    # files.
+    digest = hashlib.blake2b(manifest_bytes, digest_size=16).hexdigest()
+    build_dir = work_dir / f"build-{digest}"
+
     try:
-        build_dir = tempfile.mkdtemp(prefix="build-", dir=work_dir)
-    except BlockingIOError:
+        build_dir.mkdir(exist_ok=True)
+    except OSError:
         console.print("Failed to create build directory. Exiting.")
         console.print_exception(show_locals=True)
         sys.exit(-1)
 
-    build_dir = Path(build_dir)
-    table.add_row("Build directory", f"{build_dir}")
+    # The files for inclusion in the firmware are only read by the firmware
+    # build, so they can optionally be staged on tmpfs rather than written to
+    # the work directory. The staging directory is removed on exit.
+    staging_dir = None
+    if config.use_tmpfs:
+        if os.access(TMPFS_DIR, os.W_OK):
+            staging_dir = Path(
+                tempfile.mkdtemp(prefix="openwrt-composer-", dir=TMPFS_DIR)
+            )
+            atexit.register(shutil.rmtree, staging_dir, ignore_errors=True)
+        else:
+            console.print(
+                f"{TMPFS_DIR} is not writable, staging files in the build directory."
+            )
+
+    builds = []
+
+    for firmware_specification in firmware_specifications:
+        table = Table(show_header=False)
+        table.add_row("Target", f"{firmware_specification.target}")
+        table.add_row("Sub-target", f"{firmware_specification.sub_target}")
+        table.add_row("Profile", f"{firmware_specification.profile}")
+        table.add_row("Extra name", f"{firmware_specification.extra_name or '<None>'}")
+        table.add_row("OpenWRT version", f"{firmware_specification.version}")
+        table.add_row("Working directory", f"{work_dir}")
+        table.add_row("Build directory", f"{build_dir}")
+
+        firmware_name = "-".join(
+            [
+                firmware_specification.version,
+                firmware_specification.target,
+                firmware_specification.sub_target,
+                firmware_specification.profile,
+            ]
+        )
+        if firmware_specification.extra_name is not None:
+            firmware_name += f"-{firmware_specification.extra_name}"
 
-    files_dir = build_dir / "files"
-    output_dir = build_dir / "firmware"
+        firmware_dir = build_dir / firmware_name
+        files_dir = (staging_dir or build_dir) / firmware_name / "files"
+        output_dir = firmware_dir / "firmware"
 
-    for directory in [files_dir, output_dir]:
+        # build_dir and staging_dir already exist, so none of these need
+        # parents=True.
+        for directory in dict.fromkeys(
+            [firmware_dir, files_dir.parent, files_dir, output_dir]
+        ):
+            try:
+                directory.mkdir(exist_ok=True)
+            except OSError:
+                console.print(f"Failed to create directory: {directory}. Exiting.")
+                console.print_exception(show_locals=True)
+                sys.exit(-1)
+
+        table.add_row("Files directory", f"{files_dir}")
+        table.add_row("Output directory", f"{output_dir}")
+
+        console.print(table)
+
+        # Create files for inclusion in firmware
         try:
-            directory.mkdir(parents=True)
-        except OSError:
+            firmware_specification.create_file_tree_at_location(files_dir)
+        except ConfigCreationError:
             console.print(
-                f"Failed to create directory: {directory.absolute()}. Exiting."
+                "Failed to create files for inclusion in firmware image. Exiting."
             )
             console.print_exception(show_locals=True)
             sys.exit(-1)
 
-    table.add_row("Files directory", f"{files_dir}")
-    table.add_row("Output directory", f"{output_dir}")
+        console.print(f"Files for inclusion created at {files_dir}")
 
-    console.print(table)
+        builds.append((firmware_specification, files_dir, output_dir))
 
-    # Create files for inclusion in firmware
+    # Build the base image once, before starting concurrent builds.
     try:
-        firmware_specification.create_file_tree_at_location(files_dir)
-    except ConfigCreationError:
-        console.print(
-            "Failed to create files for inclusion in firmware image. Exiting."
-        )
+        with _create_builder(
+            firmware_specifications[0], work_dir, openwrt_base_url, podman_uri
+        ) as builder:
+            builder.prepare_base_image()
+    except BaseImageBuildFailure:
+        console.print("Base image build failed. Exiting.")
         console.print_exception(show_locals=True)
         sys.exit(-1)
 
-    console.print(f"Files for inclusion created at {files_dir}")
-
-    # Create package list
-    if firmware_specification.packages is not None:
-        packages = firmware_specification.packages.as_string()
-    else:
-        packages = None
-
     # Build the firmware
     console.print("Building firmware with OpenWRT ImageBuilder...")
 
-    if config.container_engine == "podman":
-        if config.podman is not None:
-            builder = PodmanBuilder(
-                version=firmware_specification.version,
-                target=firmware_specification.target,
-                sub_target=firmware_specification.sub_target,
-                profile=firmware_specification.profile,
-                work_dir=work_dir,
-                openwrt_base_url=config.openwrt_base_url,
-                podman_uri=config.podman.uri,
-            )
-        else:
-            console.print(
-                "podman container engine specified but podman configuration not found. Exiting."
-            )
-            sys.exit(-1)
-    else:
-        console.print(
-            "No supported container engine specified in configuration. Exiting."
-        )
-        sys.exit(-1)
+    if jobs is None:
+        jobs = config.max_parallel or max(1, (os.cpu_count() or 1) - 2)
 
-    try:
-        builder.build_firmware(
-            output_dir, packages, files_dir, firmware_specification.extra_name
+    # Firmware builds sharing a version, target and sub-target share a builder
+    # image. Build each builder image once up front, so that concurrent firmware
+    # builds don't race to download the same archive and build the same image.
+    groups = {}
+    for build_spec in builds:
+        firmware_specification = build_spec[0]
+        key = (
+            firmware_specification.version,
+            firmware_specification.target,
+            firmware_specification.sub_target,
         )
-    except FirmwareBuildFailure:
-        console.print("Firmware build failed. Exiting.")
-        console.print_exception(show_locals=True)
-        sys.exit(-1)
+        groups.setdefault(key, []).append(build_spec)
+
+    # A failed build doesn't cancel its siblings: every build is run to
+    # completion and the failures are reported before exiting.
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(builds))) as executor:
+        futures = {
+            executor.submit(
+                _prepare_builder_image,
+                group[0][0],
+                work_dir,
+                openwrt_base_url,
+                podman_uri,
+            ): key
+            for key, group in groups.items()
+        }
 
-    console.print(f"Firmware written to: {output_dir.absolute()}")
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                future.result()
+            except Exception:
+                # None of the firmware sharing a failed builder image can be
+                # built, so they are all counted as failed.
+                failed += len(groups.pop(key))
+                console.print(f"Builder image build for {'-'.join(key)} failed.")
+                console.print_exception(show_locals=True)
+
+        futures = {
+            executor.submit(
+                _build_firmware,
+                firmware_specification,
+                work_dir,
+                files_dir,
+                output_dir,
+                openwrt_base_url,
+                podman_uri,
+            ): output_dir
+            for group in groups.values()
+            for firmware_specification, files_dir, output_dir in group
+        }
+
+        for future in as_completed(futures):
+            output_dir = futures[future]
+            try:
+                future.result()
+            except Exception:
+                # Any failure in a worker (including a broken pool) is
+                # counted against its build rather than aborting the loop.
+                failed += 1
+                console.print(f"Firmware build for {output_dir.parent.name} failed.")
+                console.print_exception(show_locals=True)
+                continue
+
+            console.print(f"Firmware written to: {output_dir}")
+
+    if failed:
+        console.print(f"{failed} of {len(builds)} firmware builds failed. Exiting.")
+        sys.exit(-1)
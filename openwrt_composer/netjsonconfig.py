@@ -1,14 +1,26 @@
 import logging
+import re
+from functools import cached_property
+from itertools import chain
 from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
 
 from netjsonconfig import OpenWrt
 from netjsonconfig.backends.openwrt.parser import config_path, packages_pattern
 from netjsonconfig.exceptions import ValidationError
 
 from .exceptions import ConfigCreationError
+from .utils import ensure_dirs, write_files
 
 logger = logging.getLogger(__name__)
 
+# Rendered UCI is pure ASCII, so match it without Unicode character classes.
+_packages_pattern = re.compile(
+    packages_pattern.pattern, packages_pattern.flags & ~re.UNICODE | re.ASCII
+)
+# The package name is on the first line of a package, followed by a blank line.
+_package_header = re.compile(r"([^\n]*)\n[^\n]*\n")
+
 
 class OpenWrtConfig(OpenWrt):
     """NetJSONConfig handler for router configuration.
@@ -16,8 +28,85 @@ class OpenWrtConfig(OpenWrt):
     This class inherits from `netjsonconfig.OpenWrt` and adds convenience methods to
     dump the configuration.
 
+    Validation and rendering of the UCI configuration are memoized, and the
+    memoized results discarded when ``config`` is reassigned. Modifying the
+    ``config`` dictionary in place is not detected.
+
     """
 
+    @property
+    def config(self) -> Optional[Dict[str, Any]]:
+        """The NetJSON configuration dictionary."""
+        return self._config
+
+    @config.setter
+    def config(self, value: Optional[Dict[str, Any]]) -> None:
+        self._config = value
+        self._validated = False
+        self._config_changed = True
+        self.__dict__.pop("rendered_uci", None)
+
+    def validate(self) -> None:
+        """Validate the configuration, skipping it if already validated.
+
+        Raises:
+            ValidationError: Raised if the configuration is not valid.
+
+        """
+        if not self._validated:
+            super().validate()
+            self._validated = True
+
+    def render(self, files: bool = True) -> str:
+        """Render the configuration.
+
+        The intermediate data cached by netjsonconfig is discarded first if
+        ``config`` has been reassigned since it was generated.
+
+        Args:
+            files: Whether to include additional files in the output.
+
+        Returns:
+            The rendered configuration.
+
+        """
+        if self._config_changed:
+            self.intermediate_data = None
+            self._config_changed = False
+        return super().render(files=files)
+
+    @cached_property
+    def rendered_uci(self) -> str:
+        """The configuration rendered as UCI, without additional files."""
+        return self.render(files=False)
+
+    def _iter_rendered_packages(self) -> Iterator[Tuple[str, str]]:
+        """Iterate over the packages in the rendered UCI configuration.
+
+        Each package starts with a match of the packages pattern and runs until
+        the next one. The name and contents are sliced straight out of the
+        rendered output rather than splitting it into intermediate strings.
+
+        Yields:
+            Tuples of package name and package contents.
+
+        """
+        uci = self.rendered_uci
+        start = None
+
+        for match in chain(_packages_pattern.finditer(uci), [None]):
+            end = len(uci) if match is None else match.start()
+
+            if start is not None and start != end:
+                header = _package_header.match(uci, start, end)
+                if header is None:
+                    yield uci[start:end].partition("\n")[0], ""
+                else:
+                    yield header.group(1), uci[header.end() : end]
+
+            if match is not None:
+                start = match.end()
+
     def create_sysupgrade_tarball(
         self, archive_dir: Path, archive_name: str = "config"
     ) -> None:
@@ -45,13 +134,45 @@ class OpenWrtConfig(OpenWrt):
             raise ConfigCreationError(msg)
 
         if not archive_dir.is_dir():
-            msg = f"{archive_dir.absolute()} does not exist"
+            msg = f"{archive_dir} does not exist"
             logger.error(msg)
             raise ConfigCreationError(msg)
 
-        self.write(archive_name, str(archive_dir.resolve()))
         tarball = archive_dir / (archive_name + ".tar.gz")
-        logger.info(f"Wrote sysupgrade tarball: {str(tarball.resolve())}")
+        try:
+            with open(tarball, "wb") as fp:
+                self.create_sysupgrade_stream(fp)
+        except IOError:
+            msg = f"Failed to write to file: {tarball}"
+            logger.exception(msg)
+            raise ConfigCreationError(msg)
+
+        logger.info("Wrote sysupgrade tarball: %s", tarball)
+
+    def create_sysupgrade_stream(self, out_fp: BinaryIO) -> None:
+        """Write the configuration as a `sysupgrade` archive to a stream.
+
+        The archive is generated in memory by netjsonconfig and written to
+        `out_fp` in a single write, without an intermediate file on disk.
+
+        Args:
+            out_fp: Binary file object to write the .tar.gz archive to.
+
+        Raises:
+            ConfigCreationError: Raised if the configuration fails to validate.
+            IOError: Raised if an error occurs writing to `out_fp`.
+
+        """
+
+        try:
+            self.validate()
+        except ValidationError:
+            msg = "Configuration failed to validate"
+            logger.exception(msg)
+            raise ConfigCreationError(msg)
+
+        archive = self.generate()
+        out_fp.write(archive.getbuffer())
 
     def create_files(self, files_dir: Path) -> None:
         """Dump configuration files to a directory.
@@ -63,8 +184,8 @@ class OpenWrtConfig(OpenWrt):
             files_dir: Directory to dump files to.
 
         Raises:
-            ConfigCreationError: Raised if `files_dir` does not exist, of if a file that
-                would be created already exists.
+            ConfigCreationError: Raised if `files_dir` does not exist, of if a file with
+                different contents already exists at a path that would be created.
 
         """
 
@@ -76,41 +197,17 @@ class OpenWrtConfig(OpenWrt):
             raise ConfigCreationError(msg)
 
         if not files_dir.is_dir():
-            msg = f"{files_dir.absolute()} does not exist"
+            msg = f"{files_dir} does not exist"
             logger.error(msg)
             raise ConfigCreationError(msg)
 
-        uci = self.render(files=False)
-
-        packages = packages_pattern.split(uci)
-        if "" in packages:
-            packages.remove("")
-
-        for package in packages:
-            lines: str = package.split("\n")
-            package_name: str = lines[0]
-            contents: str = "\n".join(lines[2:])
-
-            path: Path = files_dir / config_path / package_name
-            if path.exists():
-                msg = f"Error writing to {path.absolute()}: file already exists"
-                logger.error(msg)
-                raise ConfigCreationError(msg)
-
-            parent = path.parents[0]
-            try:
-                parent.mkdir(parents=True)
-            except IOError:
-                logger.exception(f"Failed to create parent directory; {parent}")
-                raise ConfigCreationError
-
-            try:
-                with open(path.absolute(), "w") as fp:
-                    fp.write(contents)
-                    logger.info(f"File written: {path.absolute()}")
-                    logger.debug("Contents:")
-                    logger.debug(contents)
-            except IOError:
-                msg = f"Failed to write to file: {path.absolute()}"
-                logger.error(msg)
-                raise ConfigCreationError(msg)
+        files = [
+            (files_dir / config_path / package_name, contents)
+            for package_name, contents in self._iter_rendered_packages()
+        ]
+
+        # All packages are written to the same directory, so create the parent
+        # directories before writing the files concurrently.
+        ensure_dirs(path.parent for path, _ in files)
+
+        write_files([(path, contents.encode("utf-8")) for path, contents in files])
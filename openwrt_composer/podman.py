@@ -1,14 +1,17 @@
 """Podman based container image builder"""
 
+import json
 import logging
+import threading
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, List, Optional, Set
 
 from podman import PodmanClient
-from podman.errors import APIError, BuildError, ContainerError, ImageNotFound
+from podman.domain.containers import Container
+from podman.errors import APIError, BuildError, ImageNotFound
 from requests.exceptions import RequestException
 
-from openwrt_composer.builder import Builder
+from openwrt_composer.builder import ArchiveCompression, Builder
 from openwrt_composer.exceptions import (
     BaseImageBuildFailure,
     BuilderImageBuildFailure,
@@ -32,8 +35,13 @@ class PodmanBuilder(Builder):
     images. Connectivity with Podman is via the REST API that Podman
     provides.
 
+    The builder holds a Podman client connection, so it should be used as a
+    context manager, or `close` called once it is no longer needed.
+
     """
 
+    __slots__ = ("podman_uri", "_client", "_tags")
+
     def __init__(
         self,
         version: str,
@@ -43,6 +51,7 @@ class PodmanBuilder(Builder):
         work_dir: Path,
         openwrt_base_url: str,
         podman_uri: PodmanUrl,
+        compression: Optional[ArchiveCompression] = None,
     ):
         super().__init__(
             version=version,
@@ -51,9 +60,25 @@ class PodmanBuilder(Builder):
             profile=profile,
             work_dir=work_dir,
             openwrt_base_url=str(openwrt_base_url),
+            compression=compression,
         )
         self.podman_uri = str(podman_uri)
 
+        # A single client, and so a single connection pool, is used for all
+        # requests made by this builder.
+        self._client = PodmanClient(base_url=self.podman_uri)
+        self._tags: Optional[Set[str]] = None
+
+    def __enter__(self) -> "PodmanBuilder":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the Podman client's resources."""
+        self._client.close()
+
     def _create_base_image(self):
         """Create base image for all firmware builder images
 
@@ -62,23 +87,25 @@ class PodmanBuilder(Builder):
 
         """
 
-        with PodmanClient(base_url=self.podman_uri) as client:
-            try:
-                _, log = client.images.build(
-                    path=self._base_context_dir.absolute(),
-                    tag=self._base_image_tag,
-                    dockerfile=self._base_context_dir.absolute() / "Containerfile",
-                )
-            except BuildError as exc:
-                logger.exception(exc)
-                msg = "Builder image build failed"
-                raise BaseImageBuildFailure(msg) from exc
-            except APIError as exc:
-                logger.exception(exc)
-                msg = "Podman API service returned an error"
-                raise BaseImageBuildFailure(msg) from exc
-            else:
-                logger.info(log)
+        context_dir = self._base_context_dir.absolute()
+        try:
+            _, log = self._client.images.build(
+                path=context_dir,
+                tag=self._base_image_tag,
+                dockerfile=context_dir / "Containerfile",
+            )
+        except BuildError as exc:
+            logger.exception(exc)
+            _log_build_output(exc.build_log, logging.ERROR)
+            msg = "Builder image build failed"
+            raise BaseImageBuildFailure(msg) from exc
+        except APIError as exc:
+            logger.exception(exc)
+            msg = "Podman API service returned an error"
+            raise BaseImageBuildFailure(msg) from exc
+        else:
+            self._tags = None
+            _log_build_output(log, logging.INFO)
 
     def _image_exists(self, tag: str):
         """Check that image exists for a given tag.
@@ -90,14 +117,28 @@ class PodmanBuilder(Builder):
             ``True`` if the image is available, ``False`` otherwise.
         """
 
-        with PodmanClient(base_url=self.podman_uri) as client:
+        return _normalise_tag(tag) in self._existing_tags()
+
+    def _existing_tags(self) -> Set[str]:
+        """Return the tags of all locally available images.
+
+        The tags are fetched with a single request and memoized until an image
+        is built. They are normalised with `_normalise_tag`.
+
+        Returns:
+            The set of normalised image tags.
+        """
+
+        if self._tags is None:
             try:
-                exists = client.images.exists(tag)
+                images = self._client.images.list()
             except RequestException as exc:
                 logger.exception(exc)
                 raise PodmanException from exc
-            else:
-                return exists
+
+            self._tags = {_normalise_tag(tag) for image in images for tag in image.tags}
+
+        return self._tags
 
     def _base_image_build_needed(self):
         """Check whether base image needs to be built.
@@ -125,23 +166,25 @@ class PodmanBuilder(Builder):
 
         """
 
-        with PodmanClient(base_url=self.podman_uri) as client:
-            try:
-                _, log = client.images.build(
-                    path=self._builder_context_dir.absolute(),
-                    tag=self._builder_image_tag,
-                    dockerfile=self._builder_context_dir.absolute() / "Containerfile",
-                )
-            except BuildError as exc:
-                logger.exception(exc)
-                msg = "Builder image build failed"
-                raise BuilderImageBuildFailure(msg) from exc
-            except APIError as exc:
-                logger.exception(exc)
-                msg = "Podman API service returned an error"
-                raise BuilderImageBuildFailure(msg) from exc
-            else:
-                logger.info(log)
+        context_dir = self._builder_context_dir.absolute()
+        try:
+            _, log = self._client.images.build(
+                path=context_dir,
+                tag=self._builder_image_tag,
+                dockerfile=context_dir / "Containerfile",
+            )
+        except BuildError as exc:
+            logger.exception(exc)
+            _log_build_output(exc.build_log, logging.ERROR)
+            msg = "Builder image build failed"
+            raise BuilderImageBuildFailure(msg) from exc
+        except APIError as exc:
+            logger.exception(exc)
+            msg = "Podman API service returned an error"
+            raise BuilderImageBuildFailure(msg) from exc
+        else:
+            self._tags = None
+            _log_build_output(log, logging.INFO)
 
     def _build_firmware(
         self,
@@ -183,36 +226,109 @@ class PodmanBuilder(Builder):
                 }
             )
 
-        with PodmanClient(base_url=self.podman_uri) as client:
-            logger.info(
-                f"Starting firmware build using image tag: {self._builder_image_tag}"
+        logger.info(
+            "Starting firmware build using image tag: %s", self._builder_image_tag
+        )
+        try:
+            container = self._client.containers.create(
+                image=self._builder_image_tag,
+                mounts=mounts,
+                userns_mode="keep-id",
+                command=build_cmd,
             )
-            try:
-                out = client.containers.run(
-                    image=self._builder_image_tag,
-                    mounts=mounts,
-                    remove=True,
-                    stdout=True,
-                    stderr=True,
-                    userns_mode="keep-id",
-                    stream=True,
-                    command=build_cmd,
+        except ImageNotFound as exc:
+            logger.exception(exc)
+            msg = "Image not found"
+            raise FirmwareBuildFailure(msg) from exc
+        except APIError as exc:
+            logger.exception(exc)
+            msg = "Podman API service returned an error"
+            raise FirmwareBuildFailure(msg) from exc
+
+        # Follow the container's output from a separate thread while waiting for
+        # it to exit, so that output is logged as it is produced rather than
+        # accumulating in Podman until the build finishes.
+        try:
+            container.start()
+            log_thread = None
+            if logger.isEnabledFor(logging.INFO):
+                log_thread = threading.Thread(
+                    target=_log_container_output, args=(container,), daemon=True
                 )
-            except ContainerError as exc:
-                logger.exception(exc)
-                msg = "Container exited with non-zero error code"
-                for msg in exc.stderr:
-                    logger.error(msg)
-                raise FirmwareBuildFailure(msg) from exc
-            except ImageNotFound as exc:
-                logger.exception(exc)
-                msg = "Image not found"
-                raise FirmwareBuildFailure(msg) from exc
-            except APIError as exc:
-                logger.exception(exc)
-                msg = "Podman API service returned an error"
-                raise FirmwareBuildFailure(msg) from exc
+                log_thread.start()
+            exit_code = container.wait()
+            if log_thread is not None:
+                log_thread.join()
+        except RequestException as exc:
+            logger.exception(exc)
+            msg = "Podman API service returned an error"
+            raise FirmwareBuildFailure(msg) from exc
+        finally:
+            try:
+                container.remove(force=True)
+            except RequestException:
+                logger.exception("Failed to remove container: %s", container.id)
+
+        if exit_code != 0:
+            msg = f"Container exited with non-zero exit code: {exit_code}"
+            logger.error(msg)
+            raise FirmwareBuildFailure(msg)
+
+
+def _normalise_tag(tag: str) -> str:
+    """Normalise an image tag for comparison with the tags Podman reports.
+
+    Podman reports locally built images as ``localhost/<name>:<tag>``, so the
+    ``localhost/`` prefix is removed, and ``:latest`` is added to tags without
+    an explicit tag.
+
+    Args:
+        tag: The image tag.
+
+    Returns:
+        The normalised tag.
+
+    """
+
+    tag = tag.removeprefix("localhost/")
+    if "@" not in tag and ":" not in tag.rpartition("/")[2]:
+        tag += ":latest"
+    return tag
+
+
+def _log_container_output(container: Container) -> None:
+    """Log the output of a running container line by line until it exits.
+
+    Args:
+        container: The container to follow the output of.
+
+    """
+
+    try:
+        for chunk in container.logs(stream=True, follow=True, stderr=True):
+            for line in chunk.decode("utf-8", "replace").splitlines():
+                logger.info(line)
+    except RequestException:
+        logger.exception("Failed to follow container output: %s", container.id)
+
+
+def _log_build_output(log: Iterable[bytes], level: int) -> None:
+    """Log the output of an image build line by line.
+
+    Args:
+        log: The JSON encoded build log lines returned by the Podman API.
+        level: The level to log the output at.
+
+    """
 
-        # Write stdout and stderr from running the container to log
-        for msg in out:
-            logger.info(msg.decode("utf-8").strip("\r\n").strip("\n"))
+    if not logger.isEnabledFor(level):
+        return
+
+    for entry in log:
+        try:
+            text = json.loads(entry).get("stream")
+        except ValueError:
+            text = entry.decode("utf-8", "replace")
+        if text:
+            for line in text.splitlines():
+                logger.log(level, line)
@@ -1,13 +1,23 @@
 """Pydantic schemas used for validation of data."""
 
 import logging
+from itertools import chain
 from pathlib import Path
-from typing import Annotated, Literal, Optional
-
-from pydantic import AnyUrl, BaseModel, HttpUrl, UrlConstraints
+from typing import Annotated, Any, Literal, Optional
+
+from pydantic import (
+    AnyUrl,
+    BaseModel,
+    Field,
+    HttpUrl,
+    UrlConstraints,
+    field_validator,
+    model_validator,
+)
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from openwrt_composer.exceptions import ConfigCreationError
+from openwrt_composer.utils import ensure_dir, ensure_dirs, write_files
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -28,10 +38,7 @@ class PackagesSpec(BaseModel):
                 image with the OpenWRT firmware builder.
 
         """
-        packages_list = self.add + [f"-{pkg}" for pkg in self.remove]
-        packages_str = " ".join(packages_list)
-
-        return packages_str
+        return " ".join(chain(self.add, ("-" + pkg for pkg in self.remove)))
 
 
 class FileContentsSpec(BaseModel):
@@ -41,44 +48,33 @@ class FileContentsSpec(BaseModel):
     def create_file_at_location(self, location: Path) -> None:
         """Write file to disk at a specifed root location.
 
+        If the file already exists with the same contents, for example when
+        rebuilding an unchanged manifest, it is left untouched.
+
         Args:
             location: Location to write the file contents to. The contents
                 will be written to `location`/`self.path`.
 
-
         Raises:
             IOError: Raised if an error occurs creating a file.
-            ConfigCreationError: Raised if `location` does not exist, if the
-               file that would be created already exists, or if the file cannot
-               be created.
+            ConfigCreationError: Raised if `location` does not exist, if a file
+               with different contents already exists at the path that would be
+               created, or if the file cannot be created.
 
         """
 
         if not location.is_dir():
-            msg = f"{location.absolute()} does not exist"
-            logger.error(msg)
-            raise ConfigCreationError(msg)
-
-        full_path = location / Path(self.path).relative_to("/")
-
-        if full_path.exists():
-            msg = f"Error writing to {full_path.absolute()}: file already exists"
+            msg = f"{location} does not exist"
             logger.error(msg)
             raise ConfigCreationError(msg)
 
-        parent = full_path.parents[0]
-        try:
-            parent.mkdir(parents=True)
-        except IOError:
-            logger.exception(f"Failed to create parent directory: {parent}")
-            raise ConfigCreationError
+        full_path = self._full_path(location)
+        ensure_dir(full_path.parent)
+        write_files([(full_path, self.contents.encode("utf-8"))])
 
-        try:
-            with open(full_path, mode="w") as fp:
-                fp.write(self.contents)
-        except IOError:
-            logger.exception(f"Failed to write to file: {full_path.absolute()}")
-            raise ConfigCreationError
+    def _full_path(self, location: Path) -> Path:
+        """The path the file is written to beneath a root location."""
+        return location / self.path.lstrip("/")
 
 
 class FirmwareSpecification(BaseModel):
@@ -93,28 +89,73 @@ class FirmwareSpecification(BaseModel):
     def create_file_tree_at_location(self, location: Path) -> None:
         """Write all files to a directory tree at a specified root location.
 
+        The files are written concurrently.
+
         Args:
             location: Location to write the directory tree to.
 
+        Raises:
+            ConfigCreationError: Raised if `location` does not exist, or if any
+                of the files cannot be created.
+
         """
-        if self.files is not None:
-            for file_ in self.files:
-                try:
-                    file_.create_file_at_location(location)
-                except ConfigCreationError:
-                    logger.exception(f"Failed to create file: {file_}")
-                    raise
+        if not self.files:
+            return
+
+        # Check the location once here, rather than once per file.
+        if not location.is_dir():
+            msg = f"{location} does not exist"
+            logger.error(msg)
+            raise ConfigCreationError(msg)
+
+        ensure_dirs(file_._full_path(location).parent for file_ in self.files)
+
+        write_files(
+            [
+                (file_._full_path(location), file_.contents.encode("utf-8"))
+                for file_ in self.files
+            ]
+        )
 
 
 class Firmware(BaseModel):
-    firmware: FirmwareSpecification
+    firmware: list[FirmwareSpecification] = Field(min_length=1)
+
+    @field_validator("firmware", mode="before")
+    @classmethod
+    def firmware_as_list(cls, value: Any) -> Any:
+        """Accept a single ``[firmware]`` table as well as ``[[firmware]]``."""
+        if isinstance(value, dict):
+            return [value]
+        return value
+
+    @model_validator(mode="after")
+    def no_duplicate_firmware(self) -> "Firmware":
+        """Reject manifests which specify the same firmware more than once.
+
+        Duplicate firmware specifications would be built into the same
+        directory, so are treated as an error.
+
+        """
+        seen = set()
+        for fw in self.firmware:
+            key = (fw.target, fw.sub_target, fw.profile, fw.version, fw.extra_name)
+            if key in seen:
+                msg = f"Duplicate firmware specification: {key}"
+                logger.error(msg)
+                raise ValueError(msg)
+            seen.add(key)
+        return self
 
 
 PodmanUrl = Annotated[AnyUrl, UrlConstraints(host_required=False)]
 
+# Parsed once at import and shared by every PodmanConfig using the default.
+_DEFAULT_PODMAN_URI = PodmanUrl("unix:///run/user/1000/podman/podman.sock")
+
 
 class PodmanConfig(BaseModel):
-    uri: PodmanUrl = PodmanUrl("unix:///run/user/1000/podman/podman.sock")
+    uri: PodmanUrl = _DEFAULT_PODMAN_URI
 
 
 class Config(BaseSettings):
@@ -122,4 +163,6 @@ class Config(BaseSettings):
     openwrt_base_url: HttpUrl = HttpUrl("https://downloads.openwrt.org/")
     work_dir: Optional[Path] = None
     podman: Optional[PodmanConfig] = None
+    max_parallel: Optional[int] = Field(default=None, ge=1)
+    use_tmpfs: bool = False
     model_config = SettingsConfigDict(env_prefix="OPENWRT_COMPOSER_")
@@ -1,13 +1,171 @@
 import logging
+import os
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Sequence, Tuple
 
 from openwrt_composer.exceptions import ConfigCreationError
-from openwrt_composer.schemas import PackagesSpec
+
+if TYPE_CHECKING:
+    # schemas imports from this module, so only import it for type checking.
+    from openwrt_composer.schemas import PackagesSpec
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# Parsed TOML files keyed by (real path, modification time, size).
+_toml_cache: Dict[Tuple[str, int, int], Dict[str, Any]] = {}
+
+
+def load_toml_file(path: Path) -> Dict[str, Any]:
+    """Load and parse a TOML file, caching the result.
+
+    The parsed contents are cached keyed on the file's real path, modification
+    time and size, so loading an unchanged file again costs a single ``stat``.
+    The returned dictionary is shared with the cache and must not be modified.
+
+    Args:
+        path: The path of the TOML file.
+
+    Returns:
+        The parsed contents of the file.
+
+    Raises:
+        OSError: Raised if the file cannot be read.
+        tomllib.TOMLDecodeError: Raised if the file is not valid TOML.
+
+    """
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+
+    try:
+        return _toml_cache[key]
+    except KeyError:
+        pass
+
+    data = tomllib.loads(Path(path).read_bytes().decode("utf-8"))
+
+    _toml_cache[key] = data
+    return data
+
+
+def ensure_dir(directory: Path) -> None:
+    """Create a directory and any missing parents, if it doesn't exist.
+
+    Args:
+        directory: The directory to create.
+
+    Raises:
+        ConfigCreationError: Raised if the directory cannot be created.
+
+    """
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError as exc:
+        msg = f"Failed to create directory: {directory}"
+        logger.exception(msg)
+        raise ConfigCreationError(msg) from exc
+
+
+def ensure_dirs(directories: Iterable[Path]) -> None:
+    """Create several directories and any missing parents.
+
+    Many files share parent directories, so each directory is created only
+    once, shallowest first.
+
+    Args:
+        directories: The directories to create.
+
+    Raises:
+        ConfigCreationError: Raised if a directory cannot be created.
+
+    """
+    for directory in sorted(set(directories), key=lambda p: len(p.parts)):
+        ensure_dir(directory)
+
+
+def write_new_file(path: Path, data: bytes) -> None:
+    """Write bytes to a file which must not already exist.
+
+    The file is created with ``O_EXCL``, so concurrent writers of the same path
+    can't both succeed, and written with unbuffered ``os.write`` calls.
+
+    Args:
+        path: The path of the file to create.
+        data: The contents of the file.
+
+    Raises:
+        FileExistsError: Raised if the file already exists.
+        OSError: Raised if the file cannot be created or written.
+
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+def write_files(files: Sequence[Tuple[Path, bytes]]) -> None:
+    """Write several new files concurrently.
+
+    The parent directories of the files must already exist. A file which
+    already exists with the same contents, for example when rebuilding an
+    unchanged manifest, is left untouched.
+
+    Args:
+        files: A sequence of (path, contents) pairs.
+
+    Raises:
+        ConfigCreationError: Raised if a file with different contents already
+            exists, or if any of the files cannot be written.
+
+    """
+    failures = 0
+    with ThreadPoolExecutor(max_workers=min(32, len(files) or 1)) as executor:
+        futures = [executor.submit(_create_file, path, data) for path, data in files]
+        for future in futures:
+            try:
+                future.result()
+            except ConfigCreationError:
+                failures += 1
+
+    if failures:
+        msg = f"Failed to write {failures} of {len(files)} files"
+        logger.error(msg)
+        raise ConfigCreationError(msg)
+
+
+def _create_file(path: Path, data: bytes) -> None:
+    """Write the contents of a new file.
+
+    Raises:
+        ConfigCreationError: Raised if a file with different contents already
+            exists, or if the file cannot be written.
+
+    """
+    try:
+        write_new_file(path, data)
+    except FileExistsError:
+        if path.is_file() and path.read_bytes() == data:
+            logger.debug("File unchanged: %s", path)
+            return
+
+        msg = f"Error writing to {path}: file already exists"
+        logger.error(msg)
+        raise ConfigCreationError(msg)
+    except IOError:
+        msg = f"Failed to write to file: {path}"
+        logger.exception(msg)
+        raise ConfigCreationError(msg)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("File written: %s", path)
+        logger.debug("Contents:\n%s", data.decode("utf-8"))
+
 
 def create_files(files: List[Dict[str, str]], files_dir: Path) -> None:
     """Write files to disk as a tree for firmware building.
@@ -29,49 +187,34 @@ def create_files(files: List[Dict[str, str]], files_dir: Path) -> None:
 
     Raises:
         KeyError: Raised if a files dict is missing a key.
-        IOError: Raised if an error occurs creating a file.
-        ConfigCreationError: Raised if `files_dir` does not exist, of if a file
-            that would be created already exists.
+        ConfigCreationError: Raised if `files_dir` does not exist, if a file
+            with different contents already exists at a path that would be
+            created, or if an error occurs creating a file.
 
     """
 
     if not files_dir.is_dir():
-        msg = f"{files_dir.absolute()} does not exist"
+        msg = f"{files_dir} does not exist"
         logger.error(msg)
         raise ConfigCreationError(msg)
 
+    planned = []
     for file in files:
         try:
-            path = files_dir / Path(file["path"]).relative_to("/")
+            path = files_dir / file["path"].lstrip("/")
             contents = file["contents"]
         except KeyError as exc:
-            logger.exception(f"Missing key for file: {exc.args[0]}")
+            logger.exception("Missing key for file: %s", exc.args[0])
             raise
 
-        if path.exists():
-            msg = f"Error writing to {path.absolute()}: file already exists"
-            logger.error(msg)
-            raise ConfigCreationError(msg)
+        planned.append((path, contents))
 
-        parent = path.parents[0]
-        try:
-            parent.mkdir(parents=True)
-        except IOError:
-            logger.exception(f"Failed to create parent directory: {parent}")
-            raise ConfigCreationError
+    ensure_dirs(path.parent for path, _ in planned)
 
-        try:
-            with open(path, mode="w") as fp:
-                fp.write(contents)
-                logger.debug(f"File written: {path.absolute()}")
-                logger.debug("Contents:")
-                logger.debug(contents)
-        except IOError:
-            logger.exception(f"Failed to write to file: {path.absolute()}")
-            raise
+    write_files([(path, contents.encode("utf-8")) for path, contents in planned])
 
 
-def create_package_list(packages: PackagesSpec) -> str:
+def create_package_list(packages: "PackagesSpec") -> str:
     """Create packages list suitable for building firmware image.
 
     Args:
@@ -84,9 +227,9 @@ def create_package_list(packages: PackagesSpec) -> str:
             building a firmware image with the OpenWRT firmware builder.
 
     """
-    packages_list: List[str] = packages.add + [f"-{pkg}" for pkg in packages.remove]
-    packages_str = " ".join(packages_list)
+    packages_str = packages.as_string()
 
-    logger.debug(f"packages string:\n{packages_str}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("packages string:\n%s", packages_str)
 
     return packages_str